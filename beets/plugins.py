@@ -36,6 +36,11 @@ PLUGIN_NAMESPACE = 'beetsplug'
 # Plugins using the Last.fm API can share the same API key.
 LASTFM_KEY = '2dc3914abf35f0d9c92d97d8f8e42b43'
 
+# Artist name normalization patterns, applied to every artist of every
+# fetched candidate. Compiled once here rather than per call.
+ARTIST_DISAMBIG_RE = re.compile(r' \(\d+\)$')
+ARTIST_ARTICLE_RE = re.compile(r'^(.*?), (a|an|the)$', re.I)
+
 # Global logger.
 log = logging.getLogger('beets')
 
@@ -693,10 +698,13 @@ class MetadataSourcePlugin(object):
             if not artist_id:
                 artist_id = artist[id_key]
             name = artist[name_key]
-            # Strip disambiguation number.
-            name = re.sub(r' \(\d+\)$', '', name)
+            # Strip disambiguation number. Most names carry no '(n)'
+            # suffix, so check for the closing parenthesis before paying
+            # for the regex.
+            if name.endswith(')'):
+                name = ARTIST_DISAMBIG_RE.sub('', name)
             # Move articles to the front.
-            name = re.sub(r'^(.*?), (a|an|the)$', r'\2 \1', name, flags=re.I)
+            name = ARTIST_ARTICLE_RE.sub(r'\2 \1', name)
             artist_names.append(name)
         artist = ', '.join(artist_names).replace(' ,', ',') or None
         return artist, artist_id
@@ -28,12 +28,16 @@ from discogs_client.exceptions import DiscogsAPIError
 from requests.exceptions import ConnectionError
 from six.moves import http_client
 import beets
+import functools
 import re
+import sys
+import threading
 import time
 import json
 import socket
 import os
-import traceback
+from collections import Counter, deque
+from multiprocessing.pool import ThreadPool
 from string import ascii_lowercase
 
 
@@ -46,6 +50,47 @@ CONNECTION_ERRORS = (ConnectionError, socket.error, http_client.HTTPException,
                      ValueError,  # JSON decoding raises a ValueError.
                      DiscogsAPIError)
 
+# Matches the standard Discogs positions (12.2.9), which can have several
+# forms (1, 1-1, A1, A1.1, A1a, ...). Compiled once, as it is applied to
+# every track of every release.
+TRACK_INDEX_RE = re.compile(
+    r'^(.*?)'           # medium: everything before medium_index.
+    r'(\d*?)'           # medium_index: a number at the end of
+                        # `position`, except if followed by a subtrack
+                        # index.
+                        # subtrack_index: can only be matched if medium
+                        # or medium_index have been matched, and can be
+    r'((?<=\w)\.[\w]+'  # - a dot followed by a string (A.1, 2.A)
+    r'|(?<=\d)[A-Z]+'   # - a string that follows a number (1A, B2a)
+    r')?'
+    r'$',
+    re.IGNORECASE
+)
+# Pre-bound method: skips a global and an attribute lookup on every
+# per-track call.
+_track_index_match = TRACK_INDEX_RE.match
+
+# Discogs release IDs are simple integers, optionally wrapped in
+# brackets or embedded in a release URL (see `album_for_id`).
+RELEASE_ID_RE = re.compile(r'(^|\[*r|discogs\.com/.+/release/)(\d+)($|\])')
+
+# Sanitizes search queries in a single pass: medium markers ("CD1",
+# "disc 2") are dropped entirely, any other non-word run collapses to a
+# space. The `re.UNICODE` flag avoids stripping non-english word
+# characters.
+QUERY_CLEAN_RE = re.compile(r'(?iu)(\b(?:CD|disc)\W*\d+)|\W+')
+
+
+def memoize(func):
+    """Like the `functools.lru_cache` decorator, but works (as a no-op)
+    on Python < 3.2.
+    """
+    if hasattr(functools, 'lru_cache'):
+        return functools.lru_cache(maxsize=1024)(func)
+    else:
+        # Do nothing when lru_cache is not available.
+        return func
+
 
 class DiscogsPlugin(BeetsPlugin):
 
@@ -66,7 +111,16 @@ class DiscogsPlugin(BeetsPlugin):
         self.discogs_client = None
         self.register_listener('import_begin', self.setup)
         self.rate_limit_per_minute = 25
-        self.last_request_timestamp = 0
+        # Timestamps of the requests made within the last minute, used
+        # as a token bucket for rate limiting.
+        self._request_times = deque()
+        self._rate_limit_lock = threading.Lock()
+        # Many releases in a candidate batch share a master release;
+        # remember fetched years to avoid re-requesting them.
+        self._master_year_cache = {}
+        # Static for the lifetime of the plugin; resolve the confuse view
+        # once instead of on every `format` call.
+        self._separator = self.config['separator'].as_str()
 
     def setup(self, session=None):
         """Create the `discogs_client` field. Authenticate if necessary.
@@ -97,25 +151,33 @@ class DiscogsPlugin(BeetsPlugin):
         self.discogs_client = Client(USER_AGENT, c_key, c_secret,
                                      token, secret)
 
-    def _time_to_next_request(self):
-        seconds_between_requests = 60 / self.rate_limit_per_minute
-        seconds_since_last_request = time.time() - self.last_request_timestamp
-        seconds_to_wait = seconds_between_requests - seconds_since_last_request
-        return seconds_to_wait
-
     def request_start(self):
         """wait for rate limit if needed
         """
-        time_to_next_request = self._time_to_next_request()
-        if time_to_next_request > 0:
-            self._log.debug('hit rate limit, waiting for {0} seconds',
-                            time_to_next_request)
-            time.sleep(time_to_next_request)
+        # Token bucket: sleep only when a full minute's worth of requests
+        # has been made within the last minute, instead of spacing every
+        # pair of requests evenly. The lock keeps concurrent fetches (see
+        # `get_albums`) within the limit: each request claims its slot
+        # before releasing it.
+        with self._rate_limit_lock:
+            now = time.time()
+            window = self._request_times
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.rate_limit_per_minute:
+                seconds_to_wait = 60 - (now - window[0])
+                self._log.debug('hit rate limit, waiting for {0} seconds',
+                                seconds_to_wait)
+                time.sleep(seconds_to_wait)
+                now = time.time()
+                while window and now - window[0] >= 60:
+                    window.popleft()
+            window.append(now)
 
     def request_finished(self):
-        """update timestamp for rate limiting
+        """kept for call-site symmetry; the token bucket claims its
+        slot in `request_start`
         """
-        self.last_request_timestamp = time.time()
 
     def reset_auth(self):
         """Delete token file & redo the auth steps.
@@ -211,11 +273,17 @@ class DiscogsPlugin(BeetsPlugin):
         # of an input string as to avoid confusion with other metadata plugins.
         # An optional bracket can follow the integer, as this is how discogs
         # displays the release ID on its webpage.
-        match = re.search(r'(^|\[*r|discogs\.com/.+/release/)(\d+)($|\])',
-                          album_id)
-        if not match:
-            return None
-        result = Release(self.discogs_client, {'id': int(match.group(2))})
+        if album_id.isdecimal():
+            # The common case: a plain release ID needs no regex at all.
+            # `isdecimal` (rather than `isdigit`) guarantees that `int`
+            # can parse the string.
+            release_id = int(album_id)
+        else:
+            match = RELEASE_ID_RE.search(album_id)
+            if not match:
+                return None
+            release_id = int(match.group(2))
+        result = Release(self.discogs_client, {'id': release_id})
         # Try to obtain title to verify that we indeed have a valid Release
         try:
             getattr(result, 'title')
@@ -237,12 +305,11 @@ class DiscogsPlugin(BeetsPlugin):
         """
         # Strip non-word characters from query. Things like "!" and "-" can
         # cause a query to return no results, even if they match the artist or
-        # album title. Use `re.UNICODE` flag to avoid stripping non-english
-        # word characters.
-        query = re.sub(r'(?u)\W+', ' ', query)
-        # Strip medium information from query, Things like "CD1" and "disk 1"
-        # can also negate an otherwise positive result.
-        query = re.sub(r'(?i)\b(CD|disc)\s*\d+', '', query)
+        # album title. Strip medium information too, as "CD1" and "disk 1"
+        # can also negate an otherwise positive result. Both are handled by
+        # a single scan of the query string.
+        query = QUERY_CLEAN_RE.sub(
+            lambda match: '' if match.group(1) else ' ', query)
 
         self.request_start()
         try:
@@ -254,13 +321,30 @@ class DiscogsPlugin(BeetsPlugin):
             self._log.debug(u"Communication error while searching for {0!r}",
                             query, exc_info=True)
             return []
-        return [album for album in map(self.get_album_info, releases[:5])
-                if album]
 
-    def get_master_year(self, master_id):
+        # Building the AlbumInfo for a search result may need another API
+        # round-trip per release (see `get_album_info`), so overlap the
+        # network latency with a thread pool, like `beets.util.par_map`.
+        # ThreadPool does not work on Python 2; fetch sequentially there.
+        candidates = releases[:5]
+        if sys.version_info[0] < 3 or len(candidates) < 2:
+            albums = map(self.get_album_info, candidates)
+        else:
+            pool = ThreadPool(len(candidates))
+            try:
+                albums = pool.map(self.get_album_info, candidates)
+            finally:
+                pool.close()
+                pool.join()
+        return [album for album in albums if album]
+
+    def get_master_year(self, master_id, retries=3):
         """Fetches a master release given its Discogs ID and returns its year
         or None if the master release is not found.
         """
+        if master_id in self._master_year_cache:
+            return self._master_year_cache[master_id]
+
         self._log.debug(u'Searching for master release {0}', master_id)
         result = Master(self.discogs_client, {'id': master_id})
 
@@ -268,14 +352,17 @@ class DiscogsPlugin(BeetsPlugin):
         try:
             year = result.fetch('year')
             self.request_finished()
+            self._master_year_cache[master_id] = year
             return year
         except DiscogsAPIError as e:
             if e.status_code != 404:
                 self._log.debug(u'API Error: {0} (query: {1})', e,
                                 result.data['resource_url'])
-                if e.status_code == 401:
+                # Bound the retries: re-authenticating cannot loop
+                # forever when the server keeps rejecting us.
+                if e.status_code == 401 and retries > 0:
                     self.reset_auth()
-                    return self.get_master_year(master_id)
+                    return self.get_master_year(master_id, retries - 1)
             return None
         except CONNECTION_ERRORS:
             self._log.debug(u'Connection error in master release lookup',
@@ -285,9 +372,15 @@ class DiscogsPlugin(BeetsPlugin):
     def get_album_info(self, result):
         """Returns an AlbumInfo object for a discogs Release object.
         """
+        # A release without an ID can neither be refreshed nor used; bail
+        # out before paying for an API round-trip.
+        if not result.data.get('id'):
+            self._log.warning(u"Release does not contain the required fields")
+            return None
+
         # Explicitly reload the `Release` fields, as they might not be yet
         # present if the result is from a `discogs_client.search()`.
-        if not result.data.get('artists'):
+        if not (result.data.get('artists') and result.data.get('tracklist')):
             result.refresh()
 
         # Sanity check for required fields. The list of required fields is
@@ -303,7 +396,8 @@ class DiscogsPlugin(BeetsPlugin):
         artist, artist_id = MetadataSourcePlugin.get_artist(
             [a.data for a in result.artists]
         )
-        album = re.sub(r' +', ' ', result.title)
+        # Collapse any runs of whitespace, without the regex engine.
+        album = ' '.join(result.title.split())
         album_id = result.data['id']
         # Use `.data` to access the tracklist directly instead of the
         # convenient `.tracklist` property, which will strip out useful artist
@@ -314,7 +408,7 @@ class DiscogsPlugin(BeetsPlugin):
         # Extract information for the optional AlbumInfo fields, if possible.
         va = result.data['artists'][0].get('name', '').lower() == 'various'
         year = result.data.get('year')
-        mediums = [t.medium for t in tracks]
+        medium_counts = Counter(t.medium for t in tracks)
         country = result.data.get('country')
         data_url = result.data.get('uri')
         style = self.format(result.data.get('styles'))
@@ -324,14 +418,15 @@ class DiscogsPlugin(BeetsPlugin):
         # Extract information for the optional AlbumInfo fields that are
         # contained on nested discogs fields.
         albumtype = media = label = catalogno = labelid = None
-        if result.data.get('formats'):
-            albumtype = ', '.join(
-                result.data['formats'][0].get('descriptions', [])) or None
-            media = result.data['formats'][0]['name']
-        if result.data.get('labels'):
-            label = result.data['labels'][0].get('name')
-            catalogno = result.data['labels'][0].get('catno')
-            labelid = result.data['labels'][0].get('id')
+        formats = result.data.get('formats')
+        if formats:
+            albumtype = ', '.join(formats[0].get('descriptions', [])) or None
+            media = formats[0]['name']
+        labels = result.data.get('labels')
+        if labels:
+            label = labels[0].get('name')
+            catalogno = labels[0].get('catno')
+            labelid = labels[0].get('id')
 
         # Additional cleanups (various artists name, catalog number, media).
         if va:
@@ -340,12 +435,13 @@ class DiscogsPlugin(BeetsPlugin):
             catalogno = None
         # Explicitly set the `media` for the tracks, since it is expected by
         # `autotag.apply_metadata`, and set `medium_total`.
+        album_id_str = str(album_id)
         for track in tracks:
             track.media = media
-            track.medium_total = mediums.count(track.medium)
+            track.medium_total = medium_counts[track.medium]
             # Discogs does not have track IDs. Invent our own IDs as proposed
             # in #2336.
-            track.track_id = str(album_id) + "-" + track.track_alt
+            track.track_id = album_id_str + '-' + track.track_alt
 
         # Retrieve master release id (returns None if there isn't one).
         master_id = result.data.get('master_id')
@@ -356,7 +452,7 @@ class DiscogsPlugin(BeetsPlugin):
         return AlbumInfo(album=album, album_id=album_id, artist=artist,
                          artist_id=artist_id, tracks=tracks,
                          albumtype=albumtype, va=va, year=year,
-                         label=label, mediums=len(set(mediums)),
+                         label=label, mediums=len(medium_counts),
                          releasegroup_id=master_id, catalognum=catalogno,
                          country=country, style=style, genre=genre,
                          media=media, original_year=original_year,
@@ -366,8 +462,7 @@ class DiscogsPlugin(BeetsPlugin):
 
     def format(self, classification):
         if classification:
-            return self.config['separator'].as_str() \
-                .join(sorted(classification))
+            return self._separator.join(sorted(classification))
         else:
             return None
 
@@ -386,12 +481,15 @@ class DiscogsPlugin(BeetsPlugin):
             # FIXME: this is an extra precaution for making sure there are no
             # side effects after #2222. It should be removed after further
             # testing.
-            self._log.debug(u'{}', traceback.format_exc())
+            self._log.debug(u'uncaught exception in coalesce_tracks',
+                            exc_info=True)
             self._log.error(u'uncaught exception in coalesce_tracks: {}', exc)
             clean_tracklist = tracklist
         tracks = []
         index_tracks = {}
         index = 0
+        concat_index_tracks = self.config['index_tracks'].get(bool)
+        get_track_info = self.get_track_info
         # Distinct works and intra-work divisions, as defined by index tracks.
         divisions, next_divisions = [], []
         for track in clean_tracklist:
@@ -403,7 +501,8 @@ class DiscogsPlugin(BeetsPlugin):
                     # divisions.
                     divisions += next_divisions
                     del next_divisions[:]
-                track_info = self.get_track_info(track, index, divisions)
+                track_info = get_track_info(track, index, divisions,
+                                            concat_index_tracks)
                 track_info.track_alt = track['position']
                 tracks.append(track_info)
             else:
@@ -432,19 +531,20 @@ class DiscogsPlugin(BeetsPlugin):
                 sides_per_medium = 2
 
         for track in tracks:
+            track_medium = track.medium
             # Handle special case where a different medium does not indicate a
             # new disc, when there is no medium_index and the ordinal of medium
             # is not sequential. For example, I, II, III, IV, V. Assume these
             # are the track index, not the medium.
             # side_count is the number of mediums or medium sides (in the case
             # of two-sided mediums) that were seen before.
-            medium_is_index = track.medium and not track.medium_index and (
-                len(track.medium) != 1 or
+            medium_is_index = track_medium and not track.medium_index and (
+                len(track_medium) != 1 or
                 # Not within standard incremental medium values (A, B, C, ...).
-                ord(track.medium) - 64 != side_count + 1
+                ord(track_medium) - 64 != side_count + 1
             )
 
-            if not medium_is_index and medium != track.medium:
+            if not medium_is_index and medium != track_medium:
                 side_count += 1
                 if sides_per_medium == 2:
                     if side_count % sides_per_medium:
@@ -455,7 +555,7 @@ class DiscogsPlugin(BeetsPlugin):
                     # Medium changed. Reset index_count.
                     medium_count += 1
                     index_count = 0
-                medium = track.medium
+                medium = track_medium
 
             index_count += 1
             medium_count = 1 if medium_count == 0 else medium_count
@@ -478,6 +578,10 @@ class DiscogsPlugin(BeetsPlugin):
         title for the merged track is the one from the previous index track,
         if present; otherwise it is a combination of the subtracks titles.
         """
+        # Resolve the config flag once instead of once per merged group:
+        # confuse view lookups are not free on a per-track hot path.
+        index_tracks = self.config['index_tracks'].get(bool)
+
         def add_merged_subtracks(tracklist, subtracks):
             """Modify `tracklist` in place, merging a list of `subtracks` into
             a single track into `tracklist`."""
@@ -504,38 +608,50 @@ class DiscogsPlugin(BeetsPlugin):
                                 subtrack['artists'] = index_track['artists']
                     # Concatenate index with track title when index_tracks
                     # option is set
-                    if self.config['index_tracks']:
+                    if index_tracks:
                         for subtrack in subtracks:
                             subtrack['title'] = '{}: {}'.format(
                                     index_track['title'], subtrack['title'])
                     tracklist.extend(subtracks)
+            elif len(subtracks) == 1:
+                # A single subtrack does not need merging.
+                tracklist.append(subtracks[0])
             else:
                 # Merge the subtracks, pick a title, and append the new track.
-                track = subtracks[0].copy()
-                track['title'] = ' / '.join([t['title'] for t in subtracks])
-                tracklist.append(track)
+                tracklist.append(dict(
+                    subtracks[0],
+                    title=' / '.join(t['title'] for t in subtracks),
+                ))
 
         # Pre-process the tracklist, trying to identify subtracks.
         subtracks = []
         tracklist = []
-        prev_subindex = ''
+        prev_subindex_key = (0, '')
         for track in raw_tracklist:
+            position = track['position']
             # Regular subtrack (track with subindex).
-            if track['position']:
-                _, _, subindex = self.get_track_index(track['position'])
+            if position:
+                # Stash the parsed position on the track so that
+                # get_track_info does not have to parse it a second time.
+                track['_track_index'] = self.get_track_index(position)
+                _, _, subindex = track['_track_index']
                 if subindex:
-                    if subindex.rjust(len(raw_tracklist)) > prev_subindex:
+                    # Compare subindices as (length, value) tuples, which
+                    # orders numeric subindices naturally ('2' before '10')
+                    # without allocating right-justified strings.
+                    subindex_key = (len(subindex), subindex)
+                    if subindex_key > prev_subindex_key:
                         # Subtrack still part of the current main track.
                         subtracks.append(track)
                     else:
                         # Subtrack part of a new group (..., 1.3, *2.1*, ...).
                         add_merged_subtracks(tracklist, subtracks)
                         subtracks = [track]
-                    prev_subindex = subindex.rjust(len(raw_tracklist))
+                    prev_subindex_key = subindex_key
                     continue
 
             # Index track with nested sub_tracks.
-            if not track['position'] and 'sub_tracks' in track:
+            if not position and 'sub_tracks' in track:
                 # Append the index track, assuming it contains the track title.
                 tracklist.append(track)
                 add_merged_subtracks(tracklist, track['sub_tracks'])
@@ -545,7 +661,7 @@ class DiscogsPlugin(BeetsPlugin):
             if subtracks:
                 add_merged_subtracks(tracklist, subtracks)
                 subtracks = []
-                prev_subindex = ''
+                prev_subindex_key = (0, '')
             tracklist.append(track)
 
         # Merge and add the remaining subtracks, if any.
@@ -554,16 +670,20 @@ class DiscogsPlugin(BeetsPlugin):
 
         return tracklist
 
-    def get_track_info(self, track, index, divisions):
+    def get_track_info(self, track, index, divisions, index_tracks=False):
         """Returns a TrackInfo object for a discogs track.
         """
         title = track['title']
-        if self.config['index_tracks']:
+        if index_tracks:
             prefix = ', '.join(divisions)
             if prefix:
                 title = '{}: {}'.format(prefix, title)
         track_id = None
-        medium, medium_index, _ = self.get_track_index(track['position'])
+        # Use the position parsed during pre-processing, if present. The
+        # pre-processing never rewrites the position of a track it has
+        # parsed, so the cached value cannot go stale.
+        medium, medium_index, _ = (track.pop('_track_index', None) or
+                                   self.get_track_index(track['position']))
         artist, artist_id = MetadataSourcePlugin.get_artist(
             track.get('artists', [])
         )
@@ -572,40 +692,36 @@ class DiscogsPlugin(BeetsPlugin):
                          artist_id=artist_id, length=length, index=index,
                          medium=medium, medium_index=medium_index)
 
+    @memoize
     def get_track_index(self, position):
         """Returns the medium, medium index and subtrack index for a discogs
-        track position."""
-        # Match the standard Discogs positions (12.2.9), which can have several
-        # forms (1, 1-1, A1, A1.1, A1a, ...).
-        match = re.match(
-            r'^(.*?)'           # medium: everything before medium_index.
-            r'(\d*?)'           # medium_index: a number at the end of
-                                # `position`, except if followed by a subtrack
-                                # index.
-                                # subtrack_index: can only be matched if medium
-                                # or medium_index have been matched, and can be
-            r'((?<=\w)\.[\w]+'  # - a dot followed by a string (A.1, 2.A)
-            r'|(?<=\d)[A-Z]+'   # - a string that follows a number (1A, B2a)
-            r')?'
-            r'$',
-            position.upper()
-        )
+        track position. Positions repeat across releases and are parsed
+        both during pre-processing and track construction, so the result
+        is memoized."""
+        match = _track_index_match(position)
 
         if match:
             medium, index, subindex = match.groups()
 
-            if subindex and subindex.startswith('.'):
-                subindex = subindex[1:]
+            # The pattern is case-insensitive; only the (short) matched
+            # groups need uppercasing, not the whole position.
+            if medium:
+                medium = medium.upper()
+            if subindex:
+                subindex = subindex.upper()
+                if subindex.startswith('.'):
+                    subindex = subindex[1:]
         else:
             self._log.debug(u'Invalid position: {0}', position)
             medium = index = subindex = None
         return medium or None, index or None, subindex or None
 
+    @memoize
     def get_track_length(self, duration):
         """Returns the track length in seconds for a discogs duration.
         """
         try:
-            length = time.strptime(duration, '%M:%S')
+            minutes, _, seconds = duration.partition(':')
+            return int(minutes) * 60 + int(seconds)
         except ValueError:
             return None
-        return length.tm_min * 60 + length.tm_sec
@@ -20,6 +20,7 @@ from __future__ import absolute_import, division, print_function
 
 import difflib
 import errno
+import functools
 import itertools
 import json
 import struct
@@ -38,6 +39,14 @@ try:
 except ImportError:
     HAS_BEAUTIFUL_SOUP = False
 
+try:
+    # Use lxml when available: it parses scraped pages several times
+    # faster than the pure-Python html.parser backend.
+    import lxml  # noqa: F401
+    BS_PARSER = 'lxml'
+except ImportError:
+    BS_PARSER = 'html.parser'
+
 try:
     import langdetect
     HAS_LANGDETECT = True
@@ -55,12 +64,20 @@ except ImportError:
 
 from beets import plugins
 from beets import ui
+from beets.util import par_map
 import beets
 
 DIV_RE = re.compile(r'<(/?)div>?', re.I)
 COMMENT_RE = re.compile(r'<!--.*-->', re.S)
 TAG_RE = re.compile(r'<[^>]*>')
 BREAK_RE = re.compile(r'\n?\s*<br([\s|/][^>]*)*>\s*\n?', re.I)
+SPACE_RUN_RE = re.compile(r' +')
+# Single-character normalizations, done in one C-level pass: CR to LF
+# and the four-per-em space (U+2005) to a regular space.
+CHAR_NORMALIZE_TABLE = {ord(u'\r'): u'\n', 0x2005: u' '}
+SCRIPT_RE = re.compile(r'(?s)<(script).*?</\1>')
+EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+SLUG_RE = re.compile(r'\W+')
 URL_CHARACTERS = {
     u'\u2018': u"'",
     u'\u2019': u"'",
@@ -77,6 +94,37 @@ URL_CHARACTERS = {
 }
 USER_AGENT = 'beets/{}'.format(beets.__version__)
 
+# An upper bound on fetched page sizes: lyrics pages are no more than a
+# couple of hundred kilobytes, so cut off anything larger instead of
+# buffering it all in memory.
+MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+
+# Alternative-generating patterns for `search_pairs`, all compiled at
+# import time (`plugins.feat_tokens` builds its phrase list from
+# constants, so the featured-artist patterns are static too).
+SEARCH_ARTIST_RES = [
+    # Remove any featuring artists from the artists name
+    re.compile(r"(.*?) {0}".format(plugins.feat_tokens()), re.IGNORECASE),
+]
+SEARCH_TITLE_RES = [
+    # Remove a parenthesized suffix from a title string. Common
+    # examples include (live), (remix), and (acoustic).
+    re.compile(r"(.+?)\s+[(].*[)]$", re.IGNORECASE),
+    # Remove any featuring artists from the title
+    re.compile(r"(.*?) {0}".format(plugins.feat_tokens(for_artist=False)),
+               re.IGNORECASE),
+    # Remove part of title after colon ':' for songs with subtitles
+    re.compile(r"(.+?)\s*:.*", re.IGNORECASE),
+]
+
+# Shared HTTP session: connection pooling and keep-alive avoid paying a
+# fresh TCP+TLS handshake for every lyrics lookup against the same host.
+r_session = requests.Session()
+r_session.headers.update({'User-Agent': USER_AGENT})
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+r_session.mount('http://', _adapter)
+r_session.mount('https://', _adapter)
+
 # The content for the base index.rst generated in ReST mode.
 REST_INDEX_TEMPLATE = u'''Lyrics
 ======
@@ -115,6 +163,15 @@ epub_tocdup = False
 
 # Utilities.
 
+def memoize(func):
+    """Cache the function's results with `functools.lru_cache` where it
+    is available (Python 3.2+), and leave the function alone elsewhere.
+    """
+    if hasattr(functools, 'lru_cache'):
+        return functools.lru_cache(maxsize=4096)(func)
+    return func
+
+
 def unichar(i):
     try:
         return six.unichr(i)
@@ -160,35 +217,28 @@ def search_pairs(item):
     """
     def generate_alternatives(string, patterns):
         """Generate string alternatives by extracting first matching group for
-           each given pattern.
+           each given compiled pattern, ignoring duplicates.
         """
         alternatives = [string]
         for pattern in patterns:
-            match = re.search(pattern, string, re.IGNORECASE)
+            match = pattern.search(string)
             if match:
-                alternatives.append(match.group(1))
+                alternative = match.group(1)
+                # Two patterns can extract the same alternative; a
+                # duplicate would just repeat the same remote search.
+                if alternative not in alternatives:
+                    alternatives.append(alternative)
         return alternatives
 
     title, artist, artist_sort = item.title, item.artist, item.artist_sort
 
-    patterns = [
-        # Remove any featuring artists from the artists name
-        r"(.*?) {0}".format(plugins.feat_tokens())]
-    artists = generate_alternatives(artist, patterns)
+    artists = generate_alternatives(artist, SEARCH_ARTIST_RES)
     # Use the artist_sort as fallback only if it differs from artist to avoid
     # repeated remote requests with the same search terms
     if artist != artist_sort:
         artists.append(artist_sort)
 
-    patterns = [
-        # Remove a parenthesized suffix from a title string. Common
-        # examples include (live), (remix), and (acoustic).
-        r"(.+?)\s+[(].*[)]$",
-        # Remove any featuring artists from the title
-        r"(.*?) {0}".format(plugins.feat_tokens(for_artist=False)),
-        # Remove part of title after colon ':' for songs with subtitles
-        r"(.+?)\s*:.*"]
-    titles = generate_alternatives(title, patterns)
+    titles = generate_alternatives(title, SEARCH_TITLE_RES)
 
     # Check for a dual song (e.g. Pink Floyd - Speak to Me / Breathe)
     # and each of them.
@@ -201,6 +251,7 @@ def search_pairs(item):
     return itertools.product(artists, multi_titles)
 
 
+@memoize
 def slug(text):
     """Make a URL-safe, human-readable version of the given text
 
@@ -216,7 +267,9 @@ def slug(text):
     slugify is not as generic as this one, which can be reused
     elsewhere.
     """
-    return re.sub(r'\W+', '-', unidecode(text).lower().strip()).strip('-')
+    # Surrounding whitespace turns into dashes that the final strip
+    # removes, so no separate `.strip()` pass is needed.
+    return SLUG_RE.sub('-', unidecode(text).lower()).strip('-')
 
 
 class Backend(object):
@@ -247,14 +300,27 @@ class Backend(object):
             # We're not overly worried about the NSA MITMing our lyrics scraper
             with warnings.catch_warnings():
                 warnings.simplefilter('ignore')
-                r = requests.get(url, verify=False, headers={
-                    'User-Agent': USER_AGENT,
-                })
+                r = r_session.get(url, verify=False, stream=True)
         except requests.RequestException as exc:
             self._log.debug(u'lyrics request failed: {0}', exc)
             return
         if r.status_code == requests.codes.ok:
-            return r.text
+            # Stream the body so an oversized page can be cut off instead
+            # of ballooning in memory.
+            chunks = []
+            total = 0
+            for chunk in r.iter_content(8192):
+                chunks.append(chunk)
+                total += len(chunk)
+                if total > MAX_RESPONSE_BYTES:
+                    self._log.debug(u'truncating oversized response: {0}',
+                                    url)
+                    r.close()
+                    break
+            # Decode the way `Response.text` would: declared encoding
+            # first, detected encoding as the fallback.
+            encoding = r.encoding or r.apparent_encoding or 'utf-8'
+            return b''.join(chunks).decode(encoding, errors='replace')
         else:
             self._log.debug(u'failed to fetch: {0} ({1})', url, r.status_code)
 
@@ -271,14 +337,22 @@ class MusiXmatch(Backend):
         r'[\[\{]': '(',
         r'[\]\}]': ')',
     }
+    # The replacement patterns are disjoint, so they can be fused into a
+    # single alternation and applied in one scan of the string instead of
+    # one full pass per pattern.
+    ENCODE_RE = re.compile('|'.join(
+        '(?P<r{0}>{1})'.format(i, old)
+        for i, old in enumerate(REPLACEMENTS)))
+    ENCODE_GROUP_REPLACEMENTS = dict(
+        ('r{0}'.format(i), new)
+        for i, new in enumerate(REPLACEMENTS.values()))
 
     URL_PATTERN = 'https://www.musixmatch.com/lyrics/%s/%s'
 
     @classmethod
     def _encode(cls, s):
-        for old, new in cls.REPLACEMENTS.items():
-            s = re.sub(old, new, s)
-
+        s = cls.ENCODE_RE.sub(
+            lambda m: cls.ENCODE_GROUP_REPLACEMENTS[m.lastgroup], s)
         return super(MusiXmatch, cls)._encode(s)
 
     def fetch(self, artist, title):
@@ -359,7 +433,7 @@ class Genius(Backend):
         search_url = self.base_url + "/search"
         data = {'q': title + " " + artist.lower()}
         try:
-            response = requests.get(
+            response = r_session.get(
                 search_url, data=data, headers=self.headers)
         except requests.RequestException as exc:
             self._log.debug(u'Genius API request failed: {0}', exc)
@@ -373,7 +447,7 @@ class Genius(Backend):
     def _scrape_lyrics_from_html(self, html):
         """Scrape lyrics from a given genius.com html"""
 
-        html = BeautifulSoup(html, "html.parser")
+        html = BeautifulSoup(html, BS_PARSER)
 
         # Remove script tags that they put in the middle of the lyrics.
         [h.extract() for h in html('script')]
@@ -433,7 +507,7 @@ class Tekstowo(Backend):
         html = _scrape_merge_paragraphs(html)
 
         try:
-            html = BeautifulSoup(html, "html.parser")
+            html = BeautifulSoup(html, BS_PARSER)
         except HTMLParseError:
             return None
 
@@ -457,7 +531,7 @@ class Tekstowo(Backend):
         html = _scrape_merge_paragraphs(html)
 
         try:
-            html = BeautifulSoup(html, "html.parser")
+            html = BeautifulSoup(html, BS_PARSER)
         except HTMLParseError:
             return None
 
@@ -483,18 +557,17 @@ def _scrape_strip_cruft(html, plain_text_out=False):
     """
     html = unescape(html)
 
-    html = html.replace('\r', '\n')  # Normalize EOL.
-    html = re.sub(r' +', ' ', html)  # Whitespaces collapse.
+    html = html.translate(CHAR_NORMALIZE_TABLE)  # Normalize EOL & spaces.
+    html = SPACE_RUN_RE.sub(' ', html)  # Whitespaces collapse.
     html = BREAK_RE.sub('\n', html)  # <br> eats up surrounding '\n'.
-    html = re.sub(r'(?s)<(script).*?</\1>', '', html)  # Strip script tags.
-    html = re.sub(u'\u2005', " ", html)  # replace unicode with regular space
+    html = SCRIPT_RE.sub('', html)  # Strip script tags.
 
     if plain_text_out:  # Strip remaining HTML tags
         html = COMMENT_RE.sub('', html)
         html = TAG_RE.sub('', html)
 
     html = '\n'.join([x.strip() for x in html.strip().split('\n')])
-    html = re.sub(r'\n{3,}', r'\n\n', html)
+    html = EXTRA_NEWLINES_RE.sub(r'\n\n', html)
     return html
 
 
@@ -523,16 +596,16 @@ def scrape_lyrics_from_html(html):
 
     # extract all long text blocks that are not code
     try:
-        soup = BeautifulSoup(html, "html.parser",
+        soup = BeautifulSoup(html, BS_PARSER,
                              parse_only=SoupStrainer(text=is_text_notcode))
     except HTMLParseError:
         return None
 
     # Get the longest text element (if any).
-    strings = sorted(soup.stripped_strings, key=len, reverse=True)
-    if strings:
-        return strings[0]
-    else:
+    try:
+        return max(soup.stripped_strings, key=len)
+    except ValueError:
+        # No text blocks at all.
         return None
 
 
@@ -689,12 +762,14 @@ class LyricsPlugin(plugins.BeetsPlugin):
         self.config['genius_api_key'].redact = True
 
         # State information for the ReST writer.
-        # First, the current artist we're writing.
+        # First, the current artist we're writing, and their slug (None
+        # until the first item opens a file).
         self.artist = u'Unknown artist'
+        self._artist_slug = None
         # The current album: False means no album yet.
         self.album = False
-        # The current rest file content. None means the file is not
-        # open yet.
+        # The fragments of the current rest file. None means the file
+        # is not open yet; they are joined and written in `writerest`.
         self.rest = None
 
         available_sources = list(self.SOURCES)
@@ -726,6 +801,18 @@ class LyricsPlugin(plugins.BeetsPlugin):
         self.backends = [self.SOURCE_BACKENDS[source](self.config, self._log)
                          for source in sources]
 
+        # Results per (artist, title) pair, including misses: alternate
+        # titles across items often repeat the same search, and a failed
+        # lookup would otherwise hit every backend again.
+        self._lyrics_cache = {}
+
+        # Snapshot the options read for every fetched item; they cannot
+        # change during a run, and confuse lookups add up over an import.
+        self._bing_client_secret = self.config['bing_client_secret'].get()
+        self._bing_lang_to = self.config['bing_lang_to'].get()
+        self._bing_lang_from = self.config['bing_lang_from'].as_str_seq()
+        self._fallback = self.config['fallback'].get()
+
     def sanitize_bs_sources(self, sources):
         for source in self.BS_SOURCES:
             if source in sources:
@@ -746,7 +833,7 @@ class LyricsPlugin(plugins.BeetsPlugin):
         }
 
         oauth_url = 'https://datamarket.accesscontrol.windows.net/v2/OAuth2-13'
-        oauth_token = json.loads(requests.post(
+        oauth_token = json.loads(r_session.post(
             oauth_url,
             data=urllib.parse.urlencode(params)).content)
         if 'access_token' in oauth_token:
@@ -817,24 +904,29 @@ class LyricsPlugin(plugins.BeetsPlugin):
         writing continuously to the same files.
         """
 
-        if slug(self.artist) != slug(item.albumartist):
+        artist_slug = slug(item.albumartist)
+        if artist_slug != self._artist_slug:
             # Write current file and start a new one ~ item.albumartist
             self.writerest(directory)
             self.artist = item.albumartist.strip()
-            self.rest = u"%s\n%s\n\n.. contents::\n   :local:\n\n" \
-                        % (self.artist,
-                           u'=' * len(self.artist))
+            self._artist_slug = artist_slug
+            # Collect fragments in a list: growing one big string with
+            # += copies the whole document on every append.
+            self.rest = [u"%s\n%s\n\n.. contents::\n   :local:\n\n"
+                         % (self.artist,
+                            u'=' * len(self.artist))]
 
         if self.album != item.album:
             tmpalbum = self.album = item.album.strip()
             if self.album == '':
                 tmpalbum = u'Unknown album'
-            self.rest += u"%s\n%s\n\n" % (tmpalbum, u'-' * len(tmpalbum))
+            self.rest.append(u"%s\n%s\n\n" % (tmpalbum,
+                                              u'-' * len(tmpalbum)))
         title_str = u":index:`%s`" % item.title.strip()
         block = u'| ' + item.lyrics.replace(u'\n', u'\n| ')
-        self.rest += u"%s\n%s\n\n%s\n\n" % (title_str,
-                                            u'~' * len(title_str),
-                                            block)
+        self.rest.append(u"%s\n%s\n\n%s\n\n" % (title_str,
+                                                u'~' * len(title_str),
+                                                block))
 
     def writerest(self, directory):
         """Write self.rest to a ReST file
@@ -843,7 +935,7 @@ class LyricsPlugin(plugins.BeetsPlugin):
             path = os.path.join(directory, 'artists',
                                 slug(self.artist) + u'.rst')
             with open(path, 'wb') as output:
-                output.write(self.rest.encode('utf-8'))
+                output.write(u''.join(self.rest).encode('utf-8'))
 
     def writerest_indexes(self, directory):
         """Write conf.py and index.rst files necessary for Sphinx
@@ -871,9 +963,13 @@ class LyricsPlugin(plugins.BeetsPlugin):
         """Import hook for fetching lyrics automatically.
         """
         if self.config['auto']:
-            for item in task.imported_items():
-                self.fetch_item_lyrics(session.lib, item,
-                                       False, self.config['force'])
+            force = self.config['force'].get(bool)
+            # The fetches are network-bound, so run them in parallel
+            # across the task's items; sqlite serializes the stores.
+            par_map(
+                lambda item: self.fetch_item_lyrics(
+                    session.lib, item, False, force),
+                task.imported_items())
 
     def fetch_item_lyrics(self, lib, item, write, force):
         """Fetch and store lyrics for a single item. If ``write``, then the
@@ -894,19 +990,17 @@ class LyricsPlugin(plugins.BeetsPlugin):
 
         if lyrics:
             self._log.info(u'fetched lyrics: {0}', item)
-            if HAS_LANGDETECT and self.config['bing_client_secret'].get():
+            if HAS_LANGDETECT and self._bing_client_secret:
                 lang_from = langdetect.detect(lyrics)
-                if self.config['bing_lang_to'].get() != lang_from and (
-                    not self.config['bing_lang_from'] or (
-                        lang_from in self.config[
-                        'bing_lang_from'].as_str_seq())):
+                if self._bing_lang_to != lang_from and (
+                        not self._bing_lang_from or
+                        lang_from in self._bing_lang_from):
                     lyrics = self.append_translation(
-                        lyrics, self.config['bing_lang_to'])
+                        lyrics, self._bing_lang_to)
         else:
             self._log.info(u'lyrics not found: {0}', item)
-            fallback = self.config['fallback'].get()
-            if fallback:
-                lyrics = fallback
+            if self._fallback:
+                lyrics = self._fallback
             else:
                 return
         item.lyrics = lyrics
@@ -918,12 +1012,21 @@ class LyricsPlugin(plugins.BeetsPlugin):
         """Fetch lyrics, trying each source in turn. Return a string or
         None if no lyrics were found.
         """
+        key = (artist, title)
+        if key in self._lyrics_cache:
+            return self._lyrics_cache[key]
+
+        result = None
         for backend in self.backends:
             lyrics = backend.fetch(artist, title)
             if lyrics:
                 self._log.debug(u'got lyrics from backend: {0}',
                                 backend.__class__.__name__)
-                return _scrape_strip_cruft(lyrics, True)
+                result = _scrape_strip_cruft(lyrics, True)
+                break
+
+        self._lyrics_cache[key] = result
+        return result
 
     def append_translation(self, text, to_lang):
         from xml.etree import ElementTree
@@ -931,12 +1034,20 @@ class LyricsPlugin(plugins.BeetsPlugin):
         if not self.bing_auth_token:
             self.bing_auth_token = self.get_bing_access_token()
         if self.bing_auth_token:
-            # Extract unique lines to limit API request size per song
-            text_lines = set(text.split('\n'))
+            # Extract unique lines to limit API request size per song,
+            # keeping their original order so the translated lines come
+            # back in a deterministic sequence.
+            lines = text.split('\n')
+            text_lines = []
+            seen = set()
+            for line in lines:
+                if line not in seen:
+                    seen.add(line)
+                    text_lines.append(line)
             url = ('https://api.microsofttranslator.com/v2/Http.svc/'
                    'Translate?text=%s&to=%s' % ('|'.join(text_lines), to_lang))
-            r = requests.get(url,
-                             headers={"Authorization ": self.bing_auth_token})
+            r = r_session.get(url,
+                              headers={"Authorization ": self.bing_auth_token})
             if r.status_code != 200:
                 self._log.debug('translation API error {}: {}', r.status_code,
                                 r.text)
@@ -948,7 +1059,5 @@ class LyricsPlugin(plugins.BeetsPlugin):
                 r.text.encode('utf-8')).text
             # Use a translation mapping dict to build resulting lyrics
             translations = dict(zip(text_lines, lines_translated.split('|')))
-            result = ''
-            for line in text.split('\n'):
-                result += '%s / %s\n' % (line, translations[line])
-            return result
+            return ''.join('%s / %s\n' % (line, translations[line])
+                           for line in lines)
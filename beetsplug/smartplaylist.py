@@ -21,13 +21,22 @@ from __future__ import division, absolute_import, print_function
 from beets.plugins import BeetsPlugin
 from beets import ui
 from beets.util import (mkdirall, normpath, sanitize_path, syspath,
-                        bytestring_path, path_as_posix)
+                        bytestring_path, path_as_posix, PATH_SEP)
 from beets.library import Item, Album, parse_query_string
 from beets.dbcore import OrQuery
 from beets.dbcore.query import MultipleSort, ParsingError
+import functools
 import os
 import six
 
+# Playlists often share query strings (and every database change may
+# trigger a rebuild), so cache the parsed queries. `lru_cache` is not
+# available on Python < 3.2; parse from scratch there.
+if hasattr(functools, 'lru_cache'):
+    _parse_query_string = functools.lru_cache(maxsize=512)(parse_query_string)
+else:
+    _parse_query_string = parse_query_string
+
 
 class SmartPlaylistPlugin(BeetsPlugin):
 
@@ -111,13 +120,13 @@ class SmartPlaylistPlugin(BeetsPlugin):
                     if qs is None:
                         query_and_sort = None, None
                     elif isinstance(qs, six.string_types):
-                        query_and_sort = parse_query_string(qs, model_cls)
+                        query_and_sort = _parse_query_string(qs, model_cls)
                     elif len(qs) == 1:
-                        query_and_sort = parse_query_string(qs[0], model_cls)
+                        query_and_sort = _parse_query_string(qs[0], model_cls)
                     else:
                         # multiple queries and sorts
-                        queries, sorts = zip(*(parse_query_string(q, model_cls)
-                                               for q in qs))
+                        queries, sorts = zip(
+                            *(_parse_query_string(q, model_cls) for q in qs))
                         query = OrQuery(queries)
                         final_sorts = []
                         for s in sorts:
@@ -154,15 +163,20 @@ class SmartPlaylistPlugin(BeetsPlugin):
         if self._unmatched_playlists is None:
             self.build_queries()
 
+        matched = []
         for playlist in self._unmatched_playlists:
             n, (q, _), (a_q, _) = playlist
             if self.matches(model, q, a_q):
                 self._log.debug(
                     u"{0} will be updated because of {1}", n, model)
-                self._matched_playlists.add(playlist)
-                self.register_listener('cli_exit', self.update_playlists)
+                matched.append(playlist)
 
-        self._unmatched_playlists -= self._matched_playlists
+        # Most change events match nothing; only touch the sets (and the
+        # cli_exit listener) when something did.
+        if matched:
+            self._matched_playlists.update(matched)
+            self._unmatched_playlists -= self._matched_playlists
+            self.register_listener('cli_exit', self.update_playlists)
 
     def update_playlists(self, lib):
         self._log.info(u"Updating {0} smart playlists...",
@@ -171,8 +185,11 @@ class SmartPlaylistPlugin(BeetsPlugin):
         playlist_dir = self.config['playlist_dir'].as_filename()
         playlist_dir = bytestring_path(playlist_dir)
         relative_to = self.config['relative_to'].get()
+        rel_prefix = None
         if relative_to:
             relative_to = normpath(relative_to)
+            rel_prefix = relative_to + PATH_SEP
+        forward_slash = self.config['forward_slash'].get()
 
         # Maps playlist filenames to lists of track filenames.
         m3us = {}
@@ -196,20 +213,43 @@ class SmartPlaylistPlugin(BeetsPlugin):
                 if m3u_name not in m3us:
                     m3us[m3u_name] = []
                 item_path = item.path
-                if relative_to:
-                    item_path = os.path.relpath(item.path, relative_to)
-                if item_path not in m3us[m3u_name]:
-                    m3us[m3u_name].append(item_path)
+                if rel_prefix:
+                    if item_path.startswith(rel_prefix):
+                        # The typical case - the item lives below
+                        # `relative_to` - reduces to a prefix strip,
+                        # with none of relpath's path-splitting work.
+                        item_path = item_path[len(rel_prefix):]
+                    else:
+                        item_path = os.path.relpath(item_path, relative_to)
+                # Duplicates (an item matching both the item and the album
+                # query) are dropped in one pass at write time instead of
+                # rescanning the list for every appended track.
+                m3us[m3u_name].append(item_path)
 
         # Write all of the accumulated track lists to files.
         for m3u in m3us:
             m3u_path = normpath(os.path.join(playlist_dir,
                                 bytestring_path(m3u)))
             mkdirall(m3u_path)
+            paths = []
+            seen = set()
+            for path in m3us[m3u]:
+                if path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+            if forward_slash:
+                paths = [path_as_posix(path) for path in paths]
+            content = b'\n'.join(paths) + b'\n'
+            # Leave playlists that have not changed alone, keeping their
+            # timestamps and sparing the rewrite.
+            try:
+                with open(syspath(m3u_path), 'rb') as f:
+                    if f.read() == content:
+                        continue
+            except (IOError, OSError):
+                pass
             with open(syspath(m3u_path), 'wb') as f:
-                for path in m3us[m3u]:
-                    if self.config['forward_slash'].get():
-                        path = path_as_posix(path)
-                    f.write(path + b'\n')
+                # One write per playlist instead of one per track.
+                f.write(content)
 
         self._log.info(u"{0} playlists updated", len(self._matched_playlists))